@@ -1,22 +1,843 @@
 """This module implements a filtered reader for MPC observations."""
 
+import array
+from collections import namedtuple
+import io
+import math
+import mmap
+import multiprocessing
+import os
+import re
+
 from astropy.coordinates import SkyCoord
 from astropy.time import Time
 import astropy.units as u
+import numpy as np
+
+try:
+    from numba import njit
+    _HAVE_NUMBA = True
+except ImportError:
+    _HAVE_NUMBA = False
+
+
+def _jit(func):
+    """Compile a function with numba if it is available."""
+    if _HAVE_NUMBA:
+        return njit(cache=True)(func)
+    return func
+
+
+# The width of an MPC formatted record.
+_RECORD_WIDTH = 80
+
+# The buffer size used when reading and writing MPC files, and the size of
+# the blocks of records parsed at once by read_file.
+_BUFFER_SIZE = 1 << 20
+
+# The approximate size of the chunks of a file given to each worker process.
+_CHUNK_SIZE = 1 << 24
+
+# The RA ('HH MM SS.sss') and dec ('+DD MM SS.ss') fields of an MPC record,
+# in columns 33-56. The trailing decimals may be blank.
+_COORDS_RE = re.compile(rb'(\d\d) (\d\d) (\d\d(?:\.\d\d\d|\.\d\d |\.\d  |\.   |    ))'
+                        rb'([+-])(\d\d) (\d\d) (\d\d(?:\.\d\d|\.\d |\.  |   ))')
+
+# The date field ('YYYY MM DD.ddddd') of an MPC record, in columns 16-32.
+# The trailing decimals may be blank.
+_DATE_RE = re.compile(rb'(\d\d\d\d) (\d\d) (\d\d)(\.\d+ *)')
+
+# The magnitude field ('MM.mm') of an MPC record, in columns 66-70. The
+# leading digit and the trailing decimals may be blank.
+_MAGNITUDE_RE = re.compile(rb'[ \d]\d\.\d* *')
+
+# A snapshot of the filter settings of a reader. Unset ranges have
+# infinite bounds so that the range checks are always evaluated, except
+# for the magnitude, which many observations do not have and which is only
+# checked if mag_filter is set.
+_FilterConfig = namedtuple('_FilterConfig', ['t0', 't1', 'ra0', 'ra1',
+                                             'dec0', 'dec1', 'mag_filter',
+                                             'mag0', 'mag1', 'name_fields',
+                                             'obscode'])
+
+
+def _civil_to_mjd(year, month, day):
+    """
+    Convert a Gregorian calendar date into the MJD at the start of that day.
+
+    Parameters
+    ----------
+    year: int
+        The calendar year.
+    month: int
+        The calendar month (1-12).
+    day: int
+        The day of the month.
+
+    Returns
+    -------
+    mjd: int
+        The MJD at 0h UTC of the given date.
+    """
+    a = (14 - month) // 12
+    y = year + 4800 - a
+    m = month + 12 * a - 3
+    jdn = (day + (153 * m + 2) // 5 + 365 * y + y // 4 - y // 100 + y // 400
+           - 32045)
+    return jdn - 2400001
+
+
+def _parse_time(line):
+    """
+    Parse the date field of an MPC formatted line.
+
+    Parameters
+    ----------
+    line: bytes
+        A single line of MPC formatted observations.
+
+    Returns
+    -------
+    time: float
+        The time of the observation in MJD or None if the field is not valid.
+    """
+    match = _DATE_RE.fullmatch(line, 15, 31)
+    if match is None:
+        return None
+    year, month, day, frac = match.groups()
+    month, day = int(month), int(day)
+    if month < 1 or month > 12 or day < 1 or day > 31:
+        return None
+    return _civil_to_mjd(int(year), month, day) + float(frac)
+
+
+def _parse_magnitude(line):
+    """
+    Parse the magnitude field of an MPC formatted line.
+
+    Parameters
+    ----------
+    line: bytes
+        A single line of MPC formatted observations.
+
+    Returns
+    -------
+    mag: float
+        The magnitude of the observation or None if the field is blank
+        or not valid.
+    """
+    match = _MAGNITUDE_RE.fullmatch(line, 65, 70)
+    if match is None:
+        return None
+    return float(match.group())
+
+
+def _parse_coords(line):
+    """
+    Parse the sexagesimal RA and dec fields of an MPC formatted line.
+
+    Parameters
+    ----------
+    line: bytes
+        A single line of MPC formatted observations.
+
+    Returns
+    -------
+    coords: tuple of float
+        The RA (in hours) and dec (in degrees) of the observation or None
+        if the fields are not valid or out of range.
+    """
+    match = _COORDS_RE.fullmatch(line, 32, 56)
+    if match is None:
+        return None
+    hours, minutes, seconds, sign, degrees, arcmin, arcsec = match.groups()
+    hours, minutes, seconds = int(hours), int(minutes), float(seconds)
+    degrees, arcmin, arcsec = int(degrees), int(arcmin), float(arcsec)
+    if hours >= 24 or minutes >= 60 or seconds >= 60:
+        return None
+    if arcmin >= 60 or arcsec >= 60:
+        return None
+    ra = hours + minutes / 60.0 + seconds / 3600.0
+    dec = degrees + arcmin / 60.0 + arcsec / 3600.0
+    if dec > 90:
+        return None
+    if sign == b'-':
+        dec = -dec
+    return ra, dec
+
+
+def _column_int(chars, start, stop, blank=False):
+    """
+    Vectorized parse of a fixed-width column of ASCII digits.
+
+    Parameters
+    ----------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of N MPC formatted records.
+    start: int
+        The first character of the column.
+    stop: int
+        One past the last character of the column.
+    blank: bool
+        If True, the column may end with blank characters, which are
+        treated as zeros.
+
+    Returns
+    -------
+    values: numpy array of int64
+        The integer value of the column in each record.
+    valid: numpy array of bool
+        Whether the column of each record could be parsed.
+    """
+    column = chars[:, start:stop]
+    digits = column.astype(np.int64) - ord('0')
+    is_digit = (digits >= 0) & (digits <= 9)
+    if blank:
+        # A blank is only accepted if the rest of the column is blank.
+        trailing = np.logical_and.accumulate(column[:, ::-1] == ord(' '), axis=1)
+        valid = (is_digit | trailing[:, ::-1]).all(axis=1)
+        digits = np.where(is_digit, digits, 0)
+    else:
+        valid = is_digit.all(axis=1)
+    weights = 10 ** np.arange(stop - start - 1, -1, -1)
+    return digits @ weights, valid
+
+
+def _column_decimal(chars, start, point, stop):
+    """
+    Vectorized parse of a fixed-width decimal column of the form 'II.FFF',
+    where the trailing fractional digits (and the decimal point if all of
+    them are) may be blank.
+
+    Parameters
+    ----------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of N MPC formatted records.
+    start: int
+        The first character of the column.
+    point: int
+        The position of the decimal point.
+    stop: int
+        One past the last character of the column.
+
+    Returns
+    -------
+    values: numpy array of float
+        The value of the column in each record.
+    valid: numpy array of bool
+        Whether the column of each record could be parsed.
+    """
+    whole, valid = _column_int(chars, start, point)
+    frac, frac_valid = _column_int(chars, point + 1, stop, blank=True)
+    valid &= frac_valid & ((chars[:, point] == ord('.')) |
+                           ((chars[:, point] == ord(' ')) &
+                            (chars[:, point + 1] == ord(' '))))
+    scale = 10 ** (stop - point - 1)
+    return (whole * scale + frac) / float(scale), valid
+
+
+def _map_file(filename):
+    """
+    Memory map a file read-only as an array of bytes.
+
+    Parameters
+    ----------
+    filename: str
+        The name of the file to map.
+
+    Returns
+    -------
+    buf: numpy array of uint8
+        The contents of the file.
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return np.zeros(0, dtype=np.uint8)
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        mm.madvise(mmap.MADV_SEQUENTIAL)
+    return np.frombuffer(mm, dtype=np.uint8)
+
+
+def _to_records(buf, starts, ends):
+    """
+    Copy lines of a file into a fixed-width character array. Short lines
+    are padded with zeros.
+
+    Parameters
+    ----------
+    buf: numpy array of uint8
+        The contents of the file.
+    starts: numpy array of int
+        The offset of the start of each line.
+    ends: numpy array of int
+        The offset of the end of each line, without the line ending.
+
+    Returns
+    -------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of the N lines.
+    """
+    ends = ends - ((ends > starts) & (buf[ends - 1] == ord('\r')))
+
+    # MPC files almost always have lines of a single length, which can be
+    # copied out of the buffer with a strided view.
+    lengths = ends - starts
+    if (len(starts) > 1 and (lengths == lengths[0]).all() and
+            (np.diff(starts) == starts[1] - starts[0]).all()):
+        width = min(lengths[0], _RECORD_WIDTH)
+        view = np.lib.stride_tricks.as_strided(
+            buf[starts[0]:], shape=(len(starts), width),
+            strides=(starts[1] - starts[0], 1), writeable=False)
+        chars = np.zeros((len(starts), _RECORD_WIDTH), dtype=np.uint8)
+        chars[:, :width] = view
+        return chars
+
+    index = starts[:, np.newaxis] + np.arange(_RECORD_WIDTH)
+    chars = buf[np.minimum(index, len(buf) - 1)]
+    chars[index >= ends[:, np.newaxis]] = 0
+    return chars
+
+
+def _read_records(buf):
+    """
+    Split the contents of an MPC file into blocks of lines of about
+    _BUFFER_SIZE bytes, so only one block of records is held in memory
+    at a time.
+
+    Parameters
+    ----------
+    buf: numpy array of uint8
+        The contents of the MPC formatted file.
+
+    Yields
+    ------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of the next N records in the file.
+    """
+    size = len(buf)
+    start = 0
+    while start < size:
+        # Find the line endings in the next block, growing the block if it
+        # does not contain a full line.
+        stop = start
+        ends = np.zeros(0, dtype=np.int64)
+        while len(ends) == 0 and stop < size:
+            stop = min(stop + _BUFFER_SIZE, size)
+            ends = np.flatnonzero(buf[start:stop] == ord('\n')) + start
+        if stop == size and (len(ends) == 0 or ends[-1] != size - 1):
+            ends = np.append(ends, size)
+
+        starts = np.concatenate(([start], ends[:-1] + 1))
+        yield _to_records(buf, starts, ends)
+        start = ends[-1] + 1
+
+
+def _name_fields(name):
+    """
+    List the 12 column name fields of the MPC records for an object. The
+    field holds the packed number in columns 1-5 and the provisional or
+    temporary designation, left-justified, in columns 6-12.
+
+    Parameters
+    ----------
+    name: str
+        The packed number or designation of the object.
+
+    Returns
+    -------
+    fields: tuple of bytes
+        The padded name fields that match the object.
+    """
+    name = name.strip().encode('latin-1')
+    fields = (name.ljust(12),)
+    if len(name) <= 7:
+        fields += ((5 * b' ' + name).ljust(12),)
+    return fields
+
+
+def _make_cfg(reader):
+    """
+    Take a snapshot of the filter settings of a reader.
+
+    Parameters
+    ----------
+    reader: MPCFilteredReader
+        The reader with the filters to apply.
+
+    Returns
+    -------
+    cfg: _FilterConfig
+        The filter settings of the reader.
+    """
+    return _FilterConfig(reader._t0, reader._t1, reader._ra0, reader._ra1,
+                         reader._dec0, reader._dec1,
+                         reader._mag_range is not None,
+                         reader._mag0, reader._mag1,
+                         reader._name_keys, reader._obscode_key)
+
+
+def _bound_check(name, low, high):
+    """
+    Build the source of a check that a variable is outside of a range,
+    leaving out the infinite bounds.
+
+    Parameters
+    ----------
+    name: str
+        The name of the variable to check.
+    low: float
+        The lower bound of the range.
+    high: float
+        The upper bound of the range.
+
+    Returns
+    -------
+    source: str
+        The source of the check or None if the range is unbounded.
+    """
+    checks = []
+    if low != -math.inf:
+        checks.append('%s < %r' % (name, low))
+    if high != math.inf:
+        checks.append('%s > %r' % (name, high))
+    return ' or '.join(checks) or None
+
+
+def _kernel_source(cfg):
+    """
+    Generate the source of a function that parses and filters a single
+    line of MPC observations. Only the active filters are included, with
+    their settings as constants.
+
+    The generated function takes the line as bytes and returns the RA (in
+    hours), dec (in degrees) and time (in MJD) of the observation or None
+    if the observation is invalid or filtered.
+
+    Parameters
+    ----------
+    cfg: _FilterConfig
+        The filter settings to apply.
+
+    Returns
+    -------
+    source: str
+        The source of a function named kernel.
+    """
+    source = ['def kernel(line):']
+
+    # The cheap string filters are checked first so that the numeric
+    # parsing is skipped for most lines when one of them is active.
+    if cfg.obscode:
+        source.append('    if line[77:80] != %r:' % cfg.obscode)
+        source.append('        return None')
+    if cfg.name_fields:
+        source.append('    if not line.startswith(%r):' % (cfg.name_fields,))
+        source.append('        return None')
+
+    # Filter on magnitude if needed. Observations without a magnitude are
+    # filtered even if the range is unbounded.
+    if cfg.mag_filter:
+        source.append('    mag = _parse_magnitude(line)')
+        source.append('    if mag is None:')
+        source.append('        return None')
+        check = _bound_check('mag', cfg.mag0, cfg.mag1)
+        if check:
+            source.append('    if %s:' % check)
+            source.append('        return None')
+
+    # Extract the time and filter on the time bounds (if needed).
+    source.append('    time = _parse_time(line)')
+    source.append('    if time is None:')
+    source.append('        return None')
+    check = _bound_check('time', cfg.t0, cfg.t1)
+    if check:
+        source.append('    if %s:' % check)
+        source.append('        return None')
+
+    # Extract the coordinates and filter on the coordinate bounds (if needed).
+    source.append('    coords = _parse_coords(line)')
+    source.append('    if coords is None:')
+    source.append('        return None')
+    source.append('    ra, dec = coords')
+    checks = [c for c in (_bound_check('ra', cfg.ra0, cfg.ra1),
+                          _bound_check('dec', cfg.dec0, cfg.dec1)) if c]
+    if checks:
+        source.append('    if %s:' % ' or '.join(checks))
+        source.append('        return None')
+    source.append('    return ra, dec, time')
+    return '\n'.join(source) + '\n'
+
+
+def _compile_kernel(source):
+    """
+    Compile a function generated by _kernel_source.
+
+    Parameters
+    ----------
+    source: str
+        The source of the function.
+
+    Returns
+    -------
+    kernel: function
+        The compiled function.
+    """
+    namespace = {'inf': math.inf, '_parse_time': _parse_time,
+                 '_parse_magnitude': _parse_magnitude,
+                 '_parse_coords': _parse_coords}
+    exec(compile(source, '<mpc_filtered_reader kernel>', 'exec'), namespace)
+    return namespace['kernel']
+
+
+def _scan_columns(chars, cfg):
+    """
+    Parse an array of MPC formatted records in one vectorized pass and
+    apply the numeric (time, coordinate and magnitude) filters.
+
+    Parameters
+    ----------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of N MPC formatted records.
+    cfg: _FilterConfig
+        The filter settings to apply.
+
+    Returns
+    -------
+    keep: numpy array of bool
+        Whether each record is valid and passed the filters.
+    ra: numpy array of float
+        The RA (in hours) of each record.
+    dec: numpy array of float
+        The dec (in degrees) of each record.
+    time: numpy array of float
+        The time (in MJD) of each record.
+    """
+    # Extract the time and filter on the time bounds.
+    year, keep = _column_int(chars, 15, 19)
+    month, valid = _column_int(chars, 20, 22)
+    keep &= valid
+    day, valid = _column_int(chars, 23, 25)
+    keep &= valid
+    frac, valid = _column_int(chars, 26, 31, blank=True)
+    keep &= valid & (chars[:, 25] == ord('.')) & (chars[:, 26] != ord(' '))
+    keep &= (month >= 1) & (month <= 12) & (day >= 1) & (day <= 31)
+    time = _civil_to_mjd(year, month, day) + frac / 1e5
+    keep &= (time >= cfg.t0) & (time <= cfg.t1)
+
+    # Extract the coordinates and filter on the coordinate bounds.
+    hours, valid = _column_int(chars, 32, 34)
+    keep &= valid
+    minutes, valid = _column_int(chars, 35, 37)
+    keep &= valid
+    seconds, valid = _column_decimal(chars, 38, 40, 44)
+    keep &= valid & (chars[:, 34] == ord(' ')) & (chars[:, 37] == ord(' '))
+    keep &= (hours < 24) & (minutes < 60) & (seconds < 60)
+    ra = hours + minutes / 60.0 + seconds / 3600.0
+
+    sign = np.where(chars[:, 44] == ord('-'), -1.0, 1.0)
+    keep &= (chars[:, 44] == ord('-')) | (chars[:, 44] == ord('+'))
+    degrees, valid = _column_int(chars, 45, 47)
+    keep &= valid
+    minutes, valid = _column_int(chars, 48, 50)
+    keep &= valid
+    seconds, valid = _column_decimal(chars, 51, 53, 56)
+    keep &= valid & (chars[:, 47] == ord(' ')) & (chars[:, 50] == ord(' '))
+    keep &= (minutes < 60) & (seconds < 60)
+    dec = sign * (degrees + minutes / 60.0 + seconds / 3600.0)
+    keep &= np.abs(dec) <= 90
+
+    keep &= (ra >= cfg.ra0) & (ra <= cfg.ra1)
+    keep &= (dec >= cfg.dec0) & (dec <= cfg.dec1)
+
+    # Filter on magnitude if needed. Observations without a magnitude are
+    # filtered.
+    if cfg.mag_filter:
+        tens, tens_valid = _column_int(chars, 65, 66)
+        ones, valid = _column_int(chars, 66, 67)
+        frac, frac_valid = _column_int(chars, 68, 70, blank=True)
+        valid &= (tens_valid | (chars[:, 65] == ord(' '))) & frac_valid
+        valid &= chars[:, 67] == ord('.')
+        whole = np.where(tens_valid, tens, 0) * 10 + ones
+        mag = (whole * 100 + frac) / 100.0
+        keep &= valid & (mag >= cfg.mag0) & (mag <= cfg.mag1)
+
+    return keep, ra, dec, time
+
+
+@_jit
+def _row_int(row, start, stop, blank):
+    """
+    Parse a fixed-width column of ASCII digits from a single record.
+
+    Parameters
+    ----------
+    row: numpy array of uint8
+        The characters of a single MPC formatted record.
+    start: int
+        The first character of the column.
+    stop: int
+        One past the last character of the column.
+    blank: bool
+        If True, the column may end with blank characters, which are
+        treated as zeros.
+
+    Returns
+    -------
+    value: int
+        The integer value of the column or -1 if it could not be parsed.
+    """
+    value = 0
+    trailing = False
+    for i in range(start, stop):
+        c = int(row[i])
+        if c >= 48 and c <= 57 and not trailing:
+            value = value * 10 + (c - 48)
+        elif blank and c == 32:
+            trailing = True
+            value = value * 10
+        else:
+            return -1
+    return value
+
+
+_civil_to_mjd_jit = _jit(_civil_to_mjd)
+
+
+@_jit
+def _scan_rows(chars, t0, t1, ra0, ra1, dec0, dec1, mag_filter, mag0, mag1):
+    """
+    Parse an array of MPC formatted records one row at a time and apply
+    the numeric (time, coordinate and magnitude) filters. Produces the same
+    result as _scan_columns, but is compiled with numba when it is available.
+
+    Parameters
+    ----------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of N MPC formatted records.
+    t0, t1, ra0, ra1, dec0, dec1, mag_filter, mag0, mag1:
+        The numeric fields of the _FilterConfig to apply.
+
+    Returns
+    -------
+    keep: numpy array of bool
+        Whether each record is valid and passed the filters.
+    ra: numpy array of float
+        The RA (in hours) of each record.
+    dec: numpy array of float
+        The dec (in degrees) of each record.
+    time: numpy array of float
+        The time (in MJD) of each record.
+    """
+    n = chars.shape[0]
+    keep = np.zeros(n, dtype=np.bool_)
+    ra = np.zeros(n)
+    dec = np.zeros(n)
+    time = np.zeros(n)
+    for i in range(n):
+        row = chars[i]
+
+        # Filter on magnitude if needed. Observations without a magnitude
+        # are filtered.
+        if mag_filter:
+            tens = 0 if row[65] == 32 else _row_int(row, 65, 66, False)
+            ones = _row_int(row, 66, 67, False)
+            frac = _row_int(row, 68, 70, True)
+            if tens < 0 or ones < 0 or frac < 0 or row[67] != 46:
+                continue
+            mag = ((tens * 10 + ones) * 100 + frac) / 100.0
+            if mag < mag0 or mag > mag1:
+                continue
+
+        # Extract the time and filter on the time bounds.
+        year = _row_int(row, 15, 19, False)
+        month = _row_int(row, 20, 22, False)
+        day = _row_int(row, 23, 25, False)
+        frac = _row_int(row, 26, 31, True)
+        if (year < 0 or month < 0 or day < 0 or frac < 0 or
+                row[25] != 46 or row[26] == 32 or
+                month < 1 or month > 12 or day < 1 or day > 31):
+            continue
+        t = _civil_to_mjd_jit(year, month, day) + frac / 1e5
+        if t < t0 or t > t1:
+            continue
+
+        # Extract the coordinates and filter on the coordinate bounds.
+        hours = _row_int(row, 32, 34, False)
+        minutes = _row_int(row, 35, 37, False)
+        seconds = _row_int(row, 38, 40, False)
+        frac = _row_int(row, 41, 44, True)
+        if (hours < 0 or minutes < 0 or seconds < 0 or frac < 0 or
+                row[34] != 32 or row[37] != 32 or
+                (row[40] != 46 and (row[40] != 32 or row[41] != 32)) or
+                hours >= 24 or minutes >= 60 or seconds >= 60):
+            continue
+        r = hours + minutes / 60.0 + (seconds * 1000 + frac) / 1e3 / 3600.0
+
+        degrees = _row_int(row, 45, 47, False)
+        minutes = _row_int(row, 48, 50, False)
+        seconds = _row_int(row, 51, 53, False)
+        frac = _row_int(row, 54, 56, True)
+        if (degrees < 0 or minutes < 0 or seconds < 0 or frac < 0 or
+                row[47] != 32 or row[50] != 32 or
+                (row[53] != 46 and (row[53] != 32 or row[54] != 32)) or
+                (row[44] != 43 and row[44] != 45) or
+                minutes >= 60 or seconds >= 60):
+            continue
+        d = degrees + minutes / 60.0 + (seconds * 100 + frac) / 1e2 / 3600.0
+        if d > 90:
+            continue
+        if row[44] == 45:
+            d = -d
+
+        if r < ra0 or r > ra1 or d < dec0 or d > dec1:
+            continue
+        keep[i] = True
+        ra[i] = r
+        dec[i] = d
+        time[i] = t
+    return keep, ra, dec, time
+
+
+def _filter_records(chars, cfg):
+    """
+    Parse and filter an array of MPC formatted records. Applies the same
+    filters as the kernel generated by _kernel_source.
+
+    Parameters
+    ----------
+    chars: numpy array of uint8
+        A (N, 80) array with the characters of N MPC formatted records.
+    cfg: _FilterConfig
+        The filter settings to apply.
+
+    Returns
+    -------
+    ra: numpy array of float
+        The RA (in hours) of the observations that passed the filters.
+    dec: numpy array of float
+        The dec (in degrees) of the observations that passed the filters.
+    time: numpy array of float
+        The times (in MJD) of the observations that passed the filters.
+    """
+    # The string filters are applied first, outside of the numeric kernel,
+    # so only the matching records are parsed.
+    if cfg.name_fields:
+        names = np.ascontiguousarray(chars[:, 0:12]).view('S12')[:, 0]
+        chars = chars[np.isin(names, cfg.name_fields)]
+    if cfg.obscode:
+        obscodes = np.ascontiguousarray(chars[:, 77:80]).view('S3')[:, 0]
+        chars = chars[obscodes == cfg.obscode]
+
+    if _HAVE_NUMBA:
+        keep, ra, dec, time = _scan_rows(chars, cfg.t0, cfg.t1, cfg.ra0,
+                                         cfg.ra1, cfg.dec0, cfg.dec1,
+                                         cfg.mag_filter, cfg.mag0, cfg.mag1)
+    else:
+        keep, ra, dec, time = _scan_columns(chars, cfg)
+    return ra[keep], dec[keep], time[keep]
+
+
+def _file_chunks(filename, chunk_size):
+    """
+    Split a file into byte ranges of roughly chunk_size bytes that start
+    and end on line boundaries.
+
+    Parameters
+    ----------
+    filename: str
+        The name of the file to split.
+    chunk_size: int
+        The approximate size of each chunk in bytes.
+
+    Returns
+    -------
+    chunks: list of tuple
+        The (filename, start, end) byte range of each chunk.
+    """
+    size = os.path.getsize(filename)
+    chunks = []
+    with open(filename, 'rb') as f:
+        start = 0
+        while start < size:
+            f.seek(start + chunk_size)
+            f.readline()
+            end = min(f.tell(), size)
+            chunks.append((filename, start, end))
+            start = end
+    return chunks
+
+
+# The line filter of a worker process of filter_file.
+_worker_kernel = None
+
+
+def _init_worker(source):
+    """
+    Compile the line filter in a worker process of filter_file.
+
+    Parameters
+    ----------
+    source: str
+        The source of the kernel generated by _kernel_source.
+    """
+    global _worker_kernel
+    _worker_kernel = _compile_kernel(source)
+
+
+def _filter_chunk(chunk):
+    """
+    Filter the lines in a byte range of an MPC file in a worker process.
+
+    Parameters
+    ----------
+    chunk: tuple
+        The (filename, start, end) byte range to filter.
+
+    Returns
+    -------
+    data: bytes
+        The lines in the byte range that passed the filters.
+    """
+    filename, start, end = chunk
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    # The lines are split on newlines only, the same as the lines of a file.
+    kernel = _worker_kernel
+    return b''.join(line for line in io.BytesIO(data)
+                    if kernel(line) is not None)
+
 
 class MPCFilteredReader():
     _name = None
+    _name_keys = None
     _ra_range = None
     _dec_range = None
     _time_range = None
     _mag_range = None
+    _t0 = -math.inf
+    _t1 = math.inf
+    _ra0 = -math.inf
+    _ra1 = math.inf
+    _dec0 = -math.inf
+    _dec1 = math.inf
+    _mag0 = -math.inf
+    _mag1 = math.inf
     _obscode = None
+    _obscode_key = None
+    _compiled_source = None
+    _compiled_kernel = None
 
     def set_name(self, name):
         self._name = name
+        self._name_keys = _name_fields(name) if name else None
+        self._compiled_kernel = None
 
     def set_obscode(self, obscode):
         self._obscode = obscode
+        self._obscode_key = obscode.encode('latin-1') if obscode else None
+        self._compiled_kernel = None
         
     def set_time_range(self, start_time, end_time):
         """
@@ -29,9 +850,30 @@ class MPCFilteredReader():
         end_time: float
             The end time of the valid range in MJD.
         """
+        if math.isnan(start_time) or math.isnan(end_time):
+            raise ValueError("start_time and end_time must not be NaN")
         if start_time > end_time:
-            raise IllegalArgumentError("start_time must be >= end_time")
+            raise ValueError("start_time must be <= end_time")
         self._time_range = (start_time, end_time)
+        self._t0 = float(start_time)
+        self._t1 = float(end_time)
+        self._compiled_kernel = None
+
+    def set_time_range_ymd(self, start_year, start_month, start_day,
+                           end_year, end_month, end_day):
+        """
+        Sets the time range of the filter to accept from calendar dates,
+        running from the start of the first date to the start of the second.
+
+        Parameters
+        ----------
+        start_year, start_month, start_day: int
+            The start date of the valid range.
+        end_year, end_month, end_day: int
+            The end date of the valid range.
+        """
+        self.set_time_range(_civil_to_mjd(start_year, start_month, start_day),
+                            _civil_to_mjd(end_year, end_month, end_day))
 
     def set_skycoords_range(self, ra_min=0.0, ra_max=24.0,
                             dec_min=-90.0, dec_max=90.0):
@@ -50,16 +892,24 @@ class MPCFilteredReader():
         dec_max: float
             The maximum dec to accept (in degrees).  
         """
+        if any(math.isnan(x) for x in (ra_min, ra_max, dec_min, dec_max)):
+            raise ValueError("ra and dec bounds must not be NaN")
         if ra_min > ra_max:
-            raise IllegalArgumentError("ra_min must be >= to ra_max")
+            raise ValueError("ra_min must be <= ra_max")
         if dec_min > dec_max:
-            raise IllegalArgumentError("dec_min must be >= dec_max")
+            raise ValueError("dec_min must be <= dec_max")
         self._ra_range = (ra_min, ra_max)
         self._dec_range = (dec_min, dec_max)
+        self._ra0 = float(ra_min)
+        self._ra1 = float(ra_max)
+        self._dec0 = float(dec_min)
+        self._dec1 = float(dec_max)
+        self._compiled_kernel = None
 
     def set_magnitude_range(self, start, end):
         """
-        Sets the magnitude range for the filter to accept.
+        Sets the magnitude range for the filter to accept. Observations
+        without a magnitude are not accepted.
 
         Parameters
         ----------
@@ -68,17 +918,37 @@ class MPCFilteredReader():
         end: float
             The end magnitude of the valid range.
         """
+        if math.isnan(start) or math.isnan(end):
+            raise ValueError("start and end must not be NaN")
         if start > end:
-            raise IllegalArgumentError("start must be >= end")
+            raise ValueError("start must be <= end")
         self._mag_range = (start, end)
+        self._mag0 = float(start)
+        self._mag1 = float(end)
+        self._compiled_kernel = None
         
+    def _build_kernel(self):
+        """
+        Get the line filter for the current filter settings, generating and
+        compiling it if the settings have changed.
+
+        Returns
+        -------
+        kernel: function
+            The kernel generated by _kernel_source.
+        """
+        if self._compiled_kernel is None:
+            self._compiled_source = _kernel_source(_make_cfg(self))
+            self._compiled_kernel = _compile_kernel(self._compiled_source)
+        return self._compiled_kernel
+
     def parse_and_filter_line(self, line):
         """
         Parse a line of MPC observations, returning None if they are invalid or filtered.
         
         Parameters
         ----------
-        line: str
+        line: str or bytes
             A single line of MPC formatted observations.
             
         Returns
@@ -86,64 +956,19 @@ class MPCFilteredReader():
         coord: astropy SkyCoord object
             A SkyCoord object with the ra, dec of the observations or
             None if the object is filtered.
-        time: astropy Time object
-            Time of the observation or None if the object is filtered.
+        time: float
+            Time of the observation in MJD or None if the object is filtered.
         """
-        filtered = False
-
-        # Extract the time and filter on the time bounds (if needed).
-        time = Time('%s-%s-%s' % (line[15:19], line[20:22], line[23:25]))
-        time = time.mjd + float(line[25:31])
-        if self._time_range and (time < self._time_range[0] or
-                                 time > self._time_range[1]):
-            filtered = True
-            time = None
-
-        # Extract the coordinates and filter (if needed).
-        coord = None
-        if not filtered:
-            try:
-                coord = SkyCoord(line[32:44], line[44:56], unit=(u.hourangle, u.deg))
-            except ValueError:
-                coord = None
-
-            if coord:
-                if self._ra_range and (coord.ra.hour < self._ra_range[0] or
-                                       coord.ra.hour > self._ra_range[1]):
-                    filtered = True
-                if self._dec_range and (coord.dec.degree < self._dec_range[0] or
-                                        coord.dec.degree > self._dec_range[1]):
-                    filtered = True
-            else:
-                filtered = True
-
-        # Filter on the name if needed.
-        if not filtered and self._name:
-            if self._name != str(line[0:12]).strip():
-                filtered = True
-
-        # Filter on the obscode if needed.
-        if not filtered and self._obscode:
-            if len(line) < 80:
-                filtered = True
-            elif line[77:80] != self._obscode:
-                filtered = True
-
-        # Filter on magnitude if needed.
-        if not filtered and self._mag_range:
-            if line[67] != '.':
-                filtered = True
-            else:
-                mag = float(line[65:70])
-                if mag < self._mag_range[0] or mag > self._mag_range[1]:
-                    filtered = True
-                
-        if filtered:
+        if isinstance(line, str):
+            line = line.encode('latin-1')
+        values = self._build_kernel()(line)
+        if values is None:
             return None, None
-        return coord, time
+        ra, dec, time = values
+        return SkyCoord(ra * u.hourangle, dec * u.deg), time
 
 
-    def read_file(self, filename):
+    def read_file(self, filename, legacy=False):
         """
         Read in a file with observations in MPC format and return
         the coordinates.
@@ -152,27 +977,42 @@ class MPCFilteredReader():
         ----------
         filename: str
             The name of the file with the MPC-formatted observations.
+        legacy: bool
+            If True, return lists with one SkyCoord object and one MJD
+            per observation instead.
     
         Returns
         -------
-        coords: List of astropy SkyCoord objects
-            A list of SkyCoord objects with the ra, dec of the observations.
-        times: List of astropy Time objects
-            Times of the observations
+        coords: astropy SkyCoord object
+            A single SkyCoord object with the ra, dec of all of the
+            observations.
+        times: astropy Time object
+            A single Time object with the times of all of the observations.
         """
-        coords = []
-        times = []
+        # The filtered values of each block are appended to flat buffers,
+        # so the memory used is 24 bytes per matching observation.
+        cfg = _make_cfg(self)
+        ra_buf = array.array('d')
+        dec_buf = array.array('d')
+        time_buf = array.array('d')
+        for chars in _read_records(_map_file(filename)):
+            # frombytes only takes a buffer of bytes, so the arrays are
+            # passed as byte views rather than copied with tobytes.
+            ra, dec, time = _filter_records(chars, cfg)
+            ra_buf.frombytes(memoryview(ra).cast('B'))
+            dec_buf.frombytes(memoryview(dec).cast('B'))
+            time_buf.frombytes(memoryview(time).cast('B'))
+        ra = np.frombuffer(ra_buf, dtype=np.float64)
+        dec = np.frombuffer(dec_buf, dtype=np.float64)
+        time = np.frombuffer(time_buf, dtype=np.float64)
+        if legacy:
+            coords = [SkyCoord(r * u.hourangle, d * u.deg) for r, d in zip(ra, dec)]
+            return coords, time.tolist()
+        coords = SkyCoord(ra=ra * u.hourangle, dec=dec * u.deg, frame='icrs')
+        return coords, Time(time, format='mjd')
 
-        with open(filename, 'r') as f:
-            for line in f:
-                coord, time = self.parse_and_filter_line(str(line))
-                if coord and time:
-                    coords.append(coord)
-                    times.append(time)
-        return coords, times
 
-
-    def filter_file(self, in_file, out_file):
+    def filter_file(self, in_file, out_file, processes=1):
         """
         Creates a MPC file that is a filtered subset of observations from the
         original MPC file. Used to pre-filter files.
@@ -184,10 +1024,30 @@ class MPCFilteredReader():
         out_file: str
             The name of the output file into which to write the filtered
             MPC-formatted observations.
+        processes: int
+            The number of worker processes to filter the file with. If None,
+            the number of CPUs is used. If 1, the file is filtered in the
+            calling process.
         """    
-        with open(in_file, 'r') as f_in:
-            with open(out_file, 'w') as f_out:
+        kernel = self._build_kernel()
+        if processes != 1:
+            with multiprocessing.Pool(processes, initializer=_init_worker,
+                                      initargs=(self._compiled_source,)) as pool:
+                with open(out_file, 'wb', buffering=_BUFFER_SIZE) as f_out:
+                    chunks = _file_chunks(in_file, _CHUNK_SIZE)
+                    for data in pool.imap(_filter_chunk, chunks):
+                        f_out.write(data)
+            return
+
+        # The matching lines are collected into a buffer that is written
+        # out about once per _BUFFER_SIZE bytes.
+        with open(in_file, 'rb', buffering=_BUFFER_SIZE) as f_in:
+            with open(out_file, 'wb') as f_out:
+                buf = bytearray()
                 for line in f_in:
-                    coord, time = self.parse_and_filter_line(str(line))
-                    if coord and time:
-                        f_out.write(line)
+                    if kernel(line) is not None:
+                        buf += line
+                        if len(buf) >= _BUFFER_SIZE:
+                            f_out.write(buf)
+                            buf.clear()
+                f_out.write(buf)
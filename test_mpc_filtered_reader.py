@@ -1,6 +1,15 @@
+from astropy.coordinates import SkyCoord
 from astropy.time import Time
+import astropy.units as u
 from mpc_filtered_reader import *
+from mpc_filtered_reader import _civil_to_mjd, _parse_coords
+from mpc_filtered_reader import _file_chunks, _make_cfg, _scan_columns, _scan_rows
+import math
+import numpy as np
+import os
+import tempfile
 import unittest
+from unittest import mock
 
 class TestMPCFilteredReader(unittest.TestCase):
 
@@ -13,35 +22,113 @@ class TestMPCFilteredReader(unittest.TestCase):
          '     000007k ZC2009 07 12.38821 20 52 22.26 -16 47 54.1                r     I41',
          '     00000m3 ZC2009 07 22.38815 20 45 14.31 -17 34 51.4          21.8 Rr     I41']
 
-    def _check_test_cases(self, reader, is_valid):
-        self.assertEqual(len(self._test_cases), len(is_valid))
-        for i in range(len(self._test_cases)):
-            coord, time = reader.parse_and_filter_line(self._test_cases[i])
+    def _check_test_cases(self, reader, is_valid, test_cases=None):
+        test_cases = test_cases or self._test_cases
+        self.assertEqual(len(test_cases), len(is_valid))
+        for i in range(len(test_cases)):
+            coord, time = reader.parse_and_filter_line(test_cases[i])
             passed = coord is not None
             self.assertEqual(passed, is_valid[i])
+        self._check_test_files(reader, is_valid, test_cases)
+
+    # Invalid lines that are skipped by every filter.
+    _invalid_cases = [
+         '     Hall2',
+         '     Hall2    C1999 06 05.0348x 17 47 47.64 -25 27 24.3          16.6 R      706',
+         '']
+
+    def _check_test_files(self, reader, is_valid, test_cases):
+        expected = [line for line, valid in zip(test_cases, is_valid) if valid]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_file = os.path.join(tmp_dir, 'obs.txt')
+            out_file = os.path.join(tmp_dir, 'filtered.txt')
+            with open(in_file, 'w') as f:
+                f.write('\n'.join(test_cases[:2] + self._invalid_cases +
+                                  test_cases[2:]) + '\n\n')
+
+            coords, times = reader.read_file(in_file)
+            self.assertEqual(coords.shape, (len(expected),))
+            self.assertEqual(times.shape, (len(expected),))
+            for i, line in enumerate(expected):
+                exp_coord, exp_time = reader.parse_and_filter_line(line)
+                self.assertAlmostEqual(coords.ra.hour[i], exp_coord.ra.hour)
+                self.assertAlmostEqual(coords.dec.degree[i], exp_coord.dec.degree)
+                self.assertAlmostEqual(times.mjd[i], exp_time)
+
+            coords, times = reader.read_file(in_file, legacy=True)
+            self.assertEqual(len(coords), len(expected))
+            self.assertEqual(len(times), len(expected))
+            for line, coord, time in zip(expected, coords, times):
+                exp_coord, exp_time = reader.parse_and_filter_line(line)
+                self.assertAlmostEqual(coord.ra.hour, exp_coord.ra.hour)
+                self.assertAlmostEqual(coord.dec.degree, exp_coord.dec.degree)
+                self.assertAlmostEqual(time, exp_time)
+
+            reader.filter_file(in_file, out_file)
+            with open(out_file, 'r') as f:
+                self.assertEqual(f.read().splitlines(), expected)
+
+            with mock.patch('mpc_filtered_reader._CHUNK_SIZE', 100):
+                reader.filter_file(in_file, out_file, processes=2)
+            with open(out_file, 'r') as f:
+                self.assertEqual(f.read().splitlines(), expected)
+
+            for line in self._invalid_cases:
+                self.assertEqual(reader.parse_and_filter_line(line), (None, None))
 
     def test_filter_on_name(self):
         reader = MPCFilteredReader()
         reader.set_name('Hall2')
-        #self._check_test_cases(reader, [True, False, False, False, False])
+        self._check_test_cases(reader, [True, False, False, False, False])
         reader.set_name('0000001')
-        #self._check_test_cases(reader, [False, False, True, False, False])
+        self._check_test_cases(reader, [False, False, True, False, False])
+
+    def test_filter_on_packed_number(self):
+        test_cases = self._test_cases + [
+            '00433         C2002 10 10.28966 01 45 43.18 +08 05 24.4                r     644']
+        reader = MPCFilteredReader()
+        reader.set_name('00433')
+        self._check_test_cases(reader, [False] * 5 + [True], test_cases)
+        reader.set_name(' 00433 ')
+        self._check_test_cases(reader, [False] * 5 + [True], test_cases)
+        reader.set_name('0043')
+        self._check_test_cases(reader, [False] * 6, test_cases)
+
+    def test_non_ascii_line(self):
+        # A non-ASCII character in a blank column does not affect the line.
+        line = self._test_cases[0][:60] + '\u00e9' + self._test_cases[0][61:]
+        reader = MPCFilteredReader()
+        reader.set_name('Hall2')
+        coord, time = reader.parse_and_filter_line(line)
+        self.assertAlmostEqual(coord.ra.hour, 17.796567, places=6)
+        self.assertEqual(reader.parse_and_filter_line(line.encode('latin-1'))[1], time)
+        reader.set_name('H\u00e4ll2')
+        self.assertEqual(reader.parse_and_filter_line(line), (None, None))
 
     def test_filter_on_obscode(self):
         reader = MPCFilteredReader()
         reader.set_obscode('706')
-        #self._check_test_cases(reader, [True, False, False, False, False])
+        self._check_test_cases(reader, [True, False, False, False, False])
         reader.set_obscode('I41')
-        #self._check_test_cases(reader, [False, False, False, True, True])
+        self._check_test_cases(reader, [False, False, False, True, True])
 
     def test_filter_on_time(self):
         reader = MPCFilteredReader()
         reader.set_time_range(Time('1999-06-04').mjd, Time('1999-06-06').mjd)
-        #self._check_test_cases(reader, [True, False, False, False, False])
+        self._check_test_cases(reader, [True, False, False, False, False])
         reader.set_time_range(Time('2009-07-10').mjd, Time('2009-07-23').mjd)
-        #self._check_test_cases(reader, [False, False, False, True, True])
+        self._check_test_cases(reader, [False, False, False, True, True])
         reader.set_time_range(Time('2009-07-22').mjd, Time('2009-07-22').mjd + 0.5)
-        #self._check_test_cases(reader, [False, False, False, False, True])
+        self._check_test_cases(reader, [False, False, False, False, True])
+
+    def test_filter_on_time_ymd(self):
+        reader = MPCFilteredReader()
+        reader.set_time_range_ymd(1999, 6, 4, 1999, 6, 6)
+        self.assertEqual(reader._time_range,
+                         (Time('1999-06-04').mjd, Time('1999-06-06').mjd))
+        self._check_test_cases(reader, [True, False, False, False, False])
+        reader.set_time_range_ymd(2009, 7, 10, 2009, 7, 23)
+        self._check_test_cases(reader, [False, False, False, True, True])
 
     def test_filter_on_coord(self):
         reader = MPCFilteredReader()
@@ -59,5 +146,229 @@ class TestMPCFilteredReader(unittest.TestCase):
         reader.set_magnitude_range(14.0, 18.0)
         self._check_test_cases(reader, [True, True, False, False, False])
 
+        # Observations without a magnitude are filtered by any range, even
+        # one that is open ended.
+        reader.set_magnitude_range(0.0, math.inf)
+        self._check_test_cases(reader, [True, True, False, False, True])
+        reader.set_magnitude_range(-math.inf, 20.0)
+        self._check_test_cases(reader, [True, True, False, False, False])
+        reader.set_magnitude_range(-math.inf, math.inf)
+        self._check_test_cases(reader, [True, True, False, False, True])
+        reader.set_magnitude_range(math.inf, math.inf)
+        self._check_test_cases(reader, [False] * 5)
+
+    def test_invalid_ranges(self):
+        reader = MPCFilteredReader()
+        with self.assertRaises(ValueError):
+            reader.set_time_range(58000.0, 57000.0)
+        with self.assertRaises(ValueError):
+            reader.set_skycoords_range(5.0, 1.0, 0.0, 10.0)
+        with self.assertRaises(ValueError):
+            reader.set_skycoords_range(1.0, 5.0, 10.0, 0.0)
+        with self.assertRaises(ValueError):
+            reader.set_magnitude_range(18.0, 14.0)
+        with self.assertRaises(ValueError):
+            reader.set_time_range(math.nan, math.nan)
+        with self.assertRaises(ValueError):
+            reader.set_skycoords_range(0.0, 24.0, math.nan, 90.0)
+        with self.assertRaises(ValueError):
+            reader.set_magnitude_range(math.nan, 20.0)
+        self._check_test_cases(reader, [True, True, True, True, True])
+
+    def test_parse_coords(self):
+        for line in self._test_cases:
+            coord = SkyCoord(line[32:44], line[44:56], unit=(u.hourangle, u.deg))
+            ra, dec = _parse_coords(line.encode())
+            self.assertAlmostEqual(ra, coord.ra.hour)
+            self.assertAlmostEqual(dec, coord.dec.degree)
+
+        line = self._test_cases[0]
+        def parse(coords):
+            return _parse_coords((line[:32] + coords + line[56:]).encode())
+        self.assertAlmostEqual(parse('00 00 00.00 -00 30 00.0 ')[1], -0.5)
+        self.assertEqual(parse('17 47 47     -25 27 24.   '),
+                         parse('17 47 47.00  -25 27 24.00 '))
+        self.assertIsNone(parse('                        '))
+        self.assertIsNone(parse('17 47 4x.64 -25 27 24.3 '))
+        self.assertIsNone(parse('17 47 47.6 4-25 27 24.3 '))
+        self.assertIsNone(parse('17:47:47.64 -25 27 24.3 '))
+        self.assertIsNone(parse('17 47 47.64  25 27 24.3 '))
+        self.assertIsNone(parse('17 47 47.64'))
+
+    def test_civil_to_mjd(self):
+        for date in ['1980-01-01', '1999-06-05', '2000-02-29', '2009-07-22']:
+            y, m, d = [int(x) for x in date.split('-')]
+            self.assertEqual(_civil_to_mjd(y, m, d), Time(date).mjd)
+
+    def test_parsers_agree(self):
+        def replace(start, text):
+            line = self._test_cases[0]
+            return line[:start] + text + line[start + len(text):]
+
+        lines = self._test_cases + [
+            '     Hall2    C1999 06 05.03484 17 47 47.6  -25 27 24            16.6 R      706',
+            '     Hall2    C1999 06 05.03484 17 47 4x.64 -25 27 24.3          16.6 R      706',
+            '     Hall2    C1999 06 05.03484 17 47 47.64  25 27 24.3          16.6 R      706',
+            '     Hall2    C1999 06 05.03484',
+            '',
+            replace(32, '17 47 47.6 4'),
+            replace(15, '1999  6 05'),
+            replace(25, '.0348 '),
+            replace(25, '.     '),
+            replace(25, '.0348x'),
+            replace(32, '17 47 47 64 '),
+            replace(44, '-25 27 24. 3'),
+            replace(65, '  .  '),
+            replace(65, ' 9.5 '),
+            replace(65, '16.  '),
+            replace(65, '1 .5 '),
+            replace(44, '+95 00 00.0 '),
+            replace(44, '-90 00 00.0 '),
+            replace(44, '-90 00 00.1 '),
+            replace(44, '-25 60 24.3 '),
+            replace(44, '-25 27 60.0 '),
+            replace(32, '17 75 47.64 '),
+            replace(32, '17 47 75.64 '),
+            replace(32, '25 47 47.64 '),
+            replace(32, '23 59 59.999'),
+            replace(15, '1999 13 05'),
+            replace(15, '1999 00 05'),
+            replace(15, '1999 06 00'),
+            replace(15, '1999 06 32'),
+            replace(15, '1999 12 31')]
+        records = np.array(lines, dtype='S80')
+        chars = records.view(np.uint8).reshape(len(records), 80)
+
+        reader = MPCFilteredReader()
+        reader.set_magnitude_range(9.0, 18.0)
+        open_reader = MPCFilteredReader()
+        open_reader.set_magnitude_range(0.0, math.inf)
+        out_of_range = [False, True, False, False, False, False, False, False, True,
+                        False, False, False, False, True]
+        expected = {
+            None: [True, True, True, True, True, True, False, False, False, False,
+                   False, False, True, False, False, False, False,
+                   True, True, True, True] + out_of_range,
+            (9.0, 18.0): [True, True, False, False, False, True, False, False, False, False,
+                          False, False, True, False, False, False, False,
+                          False, True, True, False] + out_of_range,
+            (0.0, math.inf): [True, True, False, False, True, True, False, False, False, False,
+                              False, False, True, False, False, False, False,
+                              False, True, True, False] + out_of_range}
+        for reader in [MPCFilteredReader(), reader, open_reader]:
+            cfg = _make_cfg(reader)
+            keep, ra, dec, time = _scan_columns(chars, cfg)
+            keep2, ra2, dec2, time2 = _scan_rows(chars, cfg.t0, cfg.t1, cfg.ra0,
+                                                 cfg.ra1, cfg.dec0, cfg.dec1,
+                                                 cfg.mag_filter, cfg.mag0, cfg.mag1)
+            self.assertEqual(keep.tolist(), expected[reader._mag_range])
+            np.testing.assert_array_equal(keep, keep2)
+            np.testing.assert_array_equal(ra[keep], ra2[keep2])
+            np.testing.assert_array_equal(dec[keep], dec2[keep2])
+            np.testing.assert_array_equal(time[keep], time2[keep2])
+
+            # The line filter used by parse_and_filter_line and filter_file
+            # keeps the same lines with the same values.
+            values = [reader._build_kernel()(line.encode()) for line in lines]
+            self.assertEqual([v is not None for v in values], keep.tolist())
+            kept = np.array([v for v in values if v is not None])
+            np.testing.assert_array_equal(kept[:, 0], ra[keep])
+            np.testing.assert_array_equal(kept[:, 1], dec[keep])
+            np.testing.assert_array_equal(kept[:, 2], time[keep])
+
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                in_file = os.path.join(tmp_dir, 'obs.txt')
+                out_file = os.path.join(tmp_dir, 'filtered.txt')
+                with open(in_file, 'w') as f:
+                    f.write('\n'.join(lines) + '\n')
+                reader.filter_file(in_file, out_file)
+                with open(out_file, 'r') as f:
+                    self.assertEqual(f.read().splitlines(),
+                                     [l for l, k in zip(lines, keep) if k])
+                coords, times = reader.read_file(in_file)
+                np.testing.assert_array_equal(times.mjd, time[keep])
+
+    def test_read_file_blocks(self):
+        reader = MPCFilteredReader()
+        reader.set_skycoords_range(17.0, 21.0, -25.5, -15.0)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_file = os.path.join(tmp_dir, 'obs.txt')
+            with open(in_file, 'w') as f:
+                f.write('\n'.join(self._test_cases + ['     Hall2']))
+
+            coords, times = reader.read_file(in_file)
+            with mock.patch('mpc_filtered_reader._BUFFER_SIZE', 100):
+                block_coords, block_times = reader.read_file(in_file)
+            self.assertEqual(block_coords.shape, (3,))
+            np.testing.assert_array_equal(block_coords.ra.hour, coords.ra.hour)
+            np.testing.assert_array_equal(block_coords.dec.degree, coords.dec.degree)
+            np.testing.assert_array_equal(block_times.mjd, times.mjd)
+
+            with open(in_file, 'w', newline='\r\n') as f:
+                f.write('\n'.join(self._test_cases) + '\n')
+            crlf_coords, crlf_times = reader.read_file(in_file)
+            np.testing.assert_array_equal(crlf_coords.ra.hour, coords.ra.hour)
+            np.testing.assert_array_equal(crlf_times.mjd, times.mjd)
+
+            open(in_file, 'w').close()
+            empty_coords, empty_times = reader.read_file(in_file)
+            self.assertEqual(empty_coords.shape, (0,))
+
+    def test_read_file_out_of_range(self):
+        # Out of range coordinates are skipped instead of failing the file.
+        line = self._test_cases[0]
+        lines = [line[:44] + '+95 00 00.0 ' + line[56:]] + self._test_cases
+        reader = MPCFilteredReader()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_file = os.path.join(tmp_dir, 'obs.txt')
+            with open(in_file, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            coords, times = reader.read_file(in_file)
+            self.assertEqual(coords.shape, (len(self._test_cases),))
+            self.assertAlmostEqual(coords.dec.degree[0], -25.456750)
+
+    def test_build_kernel(self):
+        reader = MPCFilteredReader()
+        reader.set_obscode('I41')
+        kernel = reader._build_kernel()
+        self.assertIs(reader._build_kernel(), kernel)
+        self.assertIn("b'I41'", reader._compiled_source)
+        self.assertNotIn('startswith', reader._compiled_source)
+        self.assertNotIn('mag', reader._compiled_source)
+
+        reader.set_time_range(Time('2009-07-22').mjd, Time('2009-07-22').mjd + 0.5)
+        self.assertIsNot(reader._build_kernel(), kernel)
+        self._check_test_cases(reader, [False, False, False, False, True])
+
+    def test_filter_file_parallel(self):
+        reader = MPCFilteredReader()
+        reader.set_skycoords_range(17.0, 21.0, -25.5, -15.0)
+        expected = [self._test_cases[i] for i in [0, 3, 4]]
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            in_file = os.path.join(tmp_dir, 'obs.txt')
+            out_file = os.path.join(tmp_dir, 'filtered.txt')
+            with open(in_file, 'w') as f:
+                f.write('\n'.join(self._test_cases) + '\n')
+
+            chunks = _file_chunks(in_file, 100)
+            self.assertEqual([(start, end) for _, start, end in chunks],
+                             [(0, 162), (162, 324), (324, 405)])
+
+            with mock.patch('mpc_filtered_reader._CHUNK_SIZE', 100):
+                reader.filter_file(in_file, out_file, processes=2)
+            with open(out_file, 'r') as f:
+                self.assertEqual(f.read().splitlines(), expected)
+
+            # A carriage return in a blank column does not end the line.
+            lines = [line[:60] + '\r' + line[61:] for line in self._test_cases]
+            with open(in_file, 'w', newline='') as f:
+                f.write('\n'.join(lines) + '\n')
+            for processes in [1, 2]:
+                with mock.patch('mpc_filtered_reader._CHUNK_SIZE', 100):
+                    reader.filter_file(in_file, out_file, processes=processes)
+                with open(out_file, 'r', newline='') as f:
+                    self.assertEqual(f.read().split('\n')[:-1],
+                                     [lines[i] for i in [0, 3, 4]])
+
 if __name__ == '__main__':
     unittest.main()